@@ -1,30 +1,133 @@
+import io
+import os
+import tempfile
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 from datetime import datetime, timedelta
 
 # Set the page title for the Streamlit application
 st.set_page_config(page_title='TALENTPOOL BREAKDOWN', layout="wide")
 st.title('TALENTPOOL BREAKDOWN')
 
+# --- System Folder Definition ---
+SYSTEM_FOLDERS = [
+    '', 'Inbox', 'Unresponsive', 'Completed', 'Unresponsive Talkscore', 'Passed MQ', 'Failed MQ',
+    'TalkScore Retake', 'Unresponsive Talkscore Retake', 'Failed TalkScore', 'Cold Leads',
+    'Cold Leads Talkscore', 'Cold Leads Talkscore Retake', 'On hold', 'Rejected',
+    'Talent Pool', 'Shortlisted', 'Hired', 'Candidate Databank', 'For Talkscore',
+    'Tier 2 Program', 'Tier 1 Program', 'For Versant', 'For Reengagement'
+]
+SYSTEM_FOLDERS_SET = frozenset(SYSTEM_FOLDERS)
+
+def is_client_folder(folder):
+    """
+    Flags rows whose (categorical) folder title is a 'Client Folder': set, and not in SYSTEM_FOLDERS.
+    """
+    categories = folder.cat.categories
+    return is_in_categories(folder, categories[~categories.isin(SYSTEM_FOLDERS_SET)])
+
 # --- Data Loading and Preprocessing ---
+DATA_FILE = "SOURCING & EARLY STAGE METRICS.csv"
+# Parquet copy of the prepared DATA_FILE, written on first load so later cold starts skip the CSV parse
+# and the preprocessing. Bump the version whenever read_csv_data() changes what it produces.
+PARQUET_FILE = "SOURCING & EARLY STAGE METRICS.v5.parquet"
+# Parquet metadata key recording which DATA_FILE (size and mtime) the copy was prepared from
+PARQUET_SOURCE_KEY = b'source_csv'
+
+def read_csv_data():
+    """
+    Parses the CSV file and prepares it for analysis.
+    - Converts date/time columns to datetime objects.
+    - Drops rows missing the essential date columns.
+    - Stores the low-cardinality text columns as categoricals and downcasts the candidate IDs.
+    - Sorts the rows by invitation date.
+    """
+    # Load the dataset with pyarrow's multithreaded parser; it infers each column's type from the whole file
+    tp = pd.read_csv(DATA_FILE, engine='pyarrow')
+
+    # Convert date columns to datetime objects, coercing errors to NaT (Not a Time)
+    tp['INVITATIONDT'] = pd.to_datetime(tp['INVITATIONDT'], errors='coerce')
+    tp['ACTIVITY_CREATED_AT'] = pd.to_datetime(tp['ACTIVITY_CREATED_AT'], errors='coerce')
+
+    # Drop rows where essential date columns have NaT values after conversion
+    tp.dropna(subset=['INVITATIONDT', 'ACTIVITY_CREATED_AT'], inplace=True)
+
+    # Low-cardinality text columns repeat across rows; as categoricals they are filtered,
+    # compared and grouped by integer code instead of by string. CEFR is optional.
+    category_columns = ['CAMPAIGN_SITE', 'CAMPAIGNTITLE', 'FOLDER_FROM_TITLE', 'FOLDER_TO_TITLE', 'CEFR', 'FAILED_REASON']
+    for col in [c for c in category_columns if c in tp.columns]:
+        tp[col] = tp[col].astype('category')
+
+    # The remaining text columns are only passed through to the download, so they are picked by
+    # type rather than by name and stored as categoricals when their values repeat
+    for col in tp.select_dtypes(include=['object', 'string']).columns:
+        if tp[col].nunique() <= len(tp) // 2:
+            tp[col] = tp[col].astype('category')
+
+    # Candidate IDs are the grouping and membership key; int32 halves the bytes every pass over them reads
+    tp['CAMPAIGNINVITATIONID'] = pd.to_numeric(tp['CAMPAIGNINVITATIONID'], downcast='integer')
+
+    # Sorted invitation dates let filter_data() find the date range by binary search.
+    # The sort is stable and keeps the file row numbers as the index, so each candidate's
+    # rows (which share one invitation date) stay in file order.
+    return tp.sort_values('INVITATIONDT', kind='stable')
+
+def read_parquet_copy(csv_source):
+    """
+    Returns the prepared frame from PARQUET_FILE, or None when the copy is missing, unreadable
+    or was prepared from a different DATA_FILE.
+    """
+    try:
+        # Only the footer is read to check where the copy came from
+        if (pq.read_schema(PARQUET_FILE).metadata or {}).get(PARQUET_SOURCE_KEY) != csv_source:
+            return None
+        # Categoricals, integer IDs, datetimes and the sorted row order all round-trip through Parquet
+        return pd.read_parquet(PARQUET_FILE)
+    except (OSError, pa.ArrowException):
+        return None
+
+def write_parquet_copy(tp, csv_source):
+    """
+    Writes the prepared frame to PARQUET_FILE, tagged with the DATA_FILE it came from.
+    - Written to a temporary file next to it and moved into place, so an interrupted write never
+      leaves a truncated copy behind.
+    """
+    table = pa.Table.from_pandas(tp)
+    table = table.replace_schema_metadata({**table.schema.metadata, PARQUET_SOURCE_KEY: csv_source})
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(PARQUET_FILE)), suffix='.tmp.parquet')
+    os.close(fd)
+    try:
+        pq.write_table(table, temp_path)
+        os.replace(temp_path, PARQUET_FILE)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
 @st.cache_data
 def load_data():
     """
     Loads and preprocesses the data from the CSV file.
-    - Reads the CSV into a pandas DataFrame.
-    - Converts date/time columns to datetime objects.
+    - Reads the prepared Parquet copy instead when it was made from the CSV as it is now (same size and mtime).
+    - Otherwise parses the CSV and refreshes the Parquet copy for the next cold start.
     - Handles potential errors during data loading.
     """
     try:
-        # Load the dataset
-        tp = pd.read_csv("SOURCING & EARLY STAGE METRICS.csv")
-
-        # Convert date columns to datetime objects, coercing errors to NaT (Not a Time)
-        tp['INVITATIONDT'] = pd.to_datetime(tp['INVITATIONDT'], errors='coerce')
-        tp['ACTIVITY_CREATED_AT'] = pd.to_datetime(tp['ACTIVITY_CREATED_AT'], errors='coerce')
-
-        # Drop rows where essential date columns have NaT values after conversion
-        tp.dropna(subset=['INVITATIONDT', 'ACTIVITY_CREATED_AT'], inplace=True)
+        csv_stat = os.stat(DATA_FILE)
+        csv_source = f"{csv_stat.st_size}:{csv_stat.st_mtime_ns}".encode()
+        tp = read_parquet_copy(csv_source)
+        if tp is not None:
+            return tp
+
+        tp = read_csv_data()
+        try:
+            write_parquet_copy(tp, csv_source)
+        except OSError:
+            # pyarrow is required (it also parses the CSV), so only filesystem errors can land here;
+            # read-only or full disks simply keep parsing the CSV on cold starts
+            pass
 
         return tp
     except FileNotFoundError:
@@ -32,21 +135,278 @@ def load_data():
         st.info("Please make sure the CSV file is in the same directory as the Streamlit script.")
         return None
 
+# --- Filter Options ---
+@st.cache_data
+def get_campaign_sites():
+    """
+    Returns the sorted campaign sites, computed once instead of on every rerun.
+    - Read from the column's categories, so the rows themselves are never scanned.
+    """
+    return sorted(load_data()['CAMPAIGN_SITE'].cat.categories)
+
+@st.cache_data
+def get_titles_by_site():
+    """
+    Returns a dict of campaign site -> set of campaign titles, built in one pass over the data.
+    """
+    site_titles = load_data()[['CAMPAIGN_SITE', 'CAMPAIGNTITLE']].dropna().drop_duplicates()
+    return {
+        site: set(titles)
+        for site, titles in site_titles.groupby('CAMPAIGN_SITE', observed=True, sort=False)['CAMPAIGNTITLE']
+    }
+
+@st.cache_data
+def get_campaign_titles(sites):
+    """
+    Returns the sorted campaign titles available for the given tuple of sites.
+    """
+    titles_by_site = get_titles_by_site()
+    return sorted(set().union(*(titles_by_site.get(site, ()) for site in sites)))
+
+# --- Breakdown Categories ---
+ROW_CATEGORIES = ['New (for endorsement)', 'Rejected (for waterfall)', 'Candidate Databank (in Cooling Period)']
+TIME_CATEGORIES = ["<24hrs", "1-3 days", "4-7 days", "8-15 days", "16-30 days", "31+ days"]
+# Lower edges (in whole days) of every TIME_CATEGORIES bucket after the first
+TIME_BUCKET_EDGES = np.array([1, 4, 8, 16, 31])
+CEFR_SEQUENCE = ["C1", "C2", "B1", "B1+", "B2", "B2+", "A0", "A2", "A2+"]
+
+# --- Data Filtering and Labeling ---
+def is_in_categories(column, values):
+    """
+    Flags rows of a categorical column whose value is one of values, like Series.isin.
+    The selection is matched against the few categories only and gathered back onto the rows through the codes.
+    """
+    # Trailing False is picked up by the -1 code of missing values, so they are never flagged
+    selected_categories = np.append(column.cat.categories.isin(values), False)
+    return selected_categories[column.cat.codes.to_numpy()]
+
+def filter_data(tp, start_date, end_date, sites, titles):
+    """
+    Returns the rows invited within [start_date, end_date] for the selected sites and titles.
+    """
+    start_datetime = datetime.combine(start_date, datetime.min.time())
+    end_datetime = datetime.combine(end_date, datetime.max.time())
+
+    # tp is sorted by INVITATIONDT, so the date range is a contiguous slice found by binary search
+    invitation_dates = tp['INVITATIONDT']
+    in_range = tp.iloc[
+        invitation_dates.searchsorted(start_datetime, side='left'):
+        invitation_dates.searchsorted(end_datetime, side='right')
+    ]
+
+    return in_range[
+        is_in_categories(in_range['CAMPAIGN_SITE'], sites) &
+        is_in_categories(in_range['CAMPAIGNTITLE'], titles)
+    ]
+
+def get_row_labels(activity):
+    # Conditions are checked in order; rows matching none of them get None
+    to_folder = activity['FOLDER_TO_TITLE']
+    in_client_folder = activity['in_client_folder']
+    has_failed_reason = activity['FAILED_REASON'].notna()
+    conditions = [
+        to_folder.eq('Candidate Databank'),
+        to_folder.eq('Talent Pool') & ~in_client_folder & ~has_failed_reason,
+        in_client_folder & to_folder.ne('Candidate Databank') & has_failed_reason,
+    ]
+    labels = ['Candidate Databank (in Cooling Period)', 'New (for endorsement)', 'Rejected (for waterfall)']
+    return np.select(conditions, labels, default=None)
+
+def get_time_buckets(activity_dates):
+    # Whole days since the activity, floored like timedelta.days, as one integer division on the raw
+    # datetime64 values; a binary search over the bucket lower edges gives each row's
+    # TIME_CATEGORIES position, used directly as the categorical code
+    days = (pd.Timestamp.now().to_datetime64() - activity_dates.to_numpy()) // np.timedelta64(1, 'D')
+    return pd.Categorical.from_codes(np.searchsorted(TIME_BUCKET_EDGES, days, side='right'), TIME_CATEGORIES)
+
+def categorize_cefr(cefr):
+    # Listed CEFR levels keep their value, missing or blank ones become 'No CEFR', anything else 'Others'
+    cefr = cefr.astype(object)
+    category = cefr.where(cefr.isin(CEFR_SEQUENCE), 'Others')
+    return category.mask(cefr.isna() | cefr.eq(''), 'No CEFR')
+
+def count_candidates(data, index, columns):
+    # Rows are one per candidate after the latest-activity dedup, so counting rows equals nunique of the ID
+    return data.groupby(index + [columns], observed=True, sort=False).size().unstack(columns, fill_value=0)
+
+def sum_counts(counts, index, columns):
+    # Collapses a Series of pre-aggregated candidate counts onto the index and column levels of a pivot
+    # Left sorted: pivots that are not reindexed afterwards (the reject reasons) rely on the sorted row order
+    return counts.groupby(level=index + [columns], observed=True).sum().unstack(columns, fill_value=0)
+
+# Time buckets are relative to now, so cached breakdowns expire after an hour;
+# max_entries bounds the cache when many different selections are explored
+@st.cache_data(ttl=3600, max_entries=64)
+def compute_breakdown(start_date, end_date, sites, titles):
+    """
+    Runs the labeling and pivot tables for one filter selection.
+    - Cached on the filter values, so reruns that repeat a selection skip the whole computation.
+    - Returns None when no rows match the filters.
+    - A pivot table is None when it has no source rows.
+    - The CEFR and rejection tables are empty when the data has no 'CEFR' column.
+    """
+    filtered_tp = filter_data(load_data(), start_date, end_date, sites, titles)
+    if filtered_tp.empty:
+        return None
+    has_cefr = 'CEFR' in filtered_tp.columns
+
+    breakdown = {'pivot_time': None, 'daily_pivot': None, 'cefr_pivot': None, 'rejection_pivot': None}
+
+    # Latest activity per candidate; the stable descending sort keeps the first of tied rows, as idxmax did.
+    # Only the columns the labels and pivots read are carried through the sort.
+    latest_activity = (
+        filtered_tp[['CAMPAIGNINVITATIONID', 'ACTIVITY_CREATED_AT', 'FOLDER_TO_TITLE', 'FAILED_REASON']
+                    + (['CEFR'] if has_cefr else [])]
+        .sort_values('ACTIVITY_CREATED_AT', ascending=False, kind='stable')
+        .drop_duplicates('CAMPAIGNINVITATIONID')
+    )
+
+    # A folder is a 'Client Folder' if it's not null/NaN and not in the SYSTEM_FOLDERS list.
+    from_is_client = is_client_folder(filtered_tp['FOLDER_FROM_TITLE'])
+    to_is_client = is_client_folder(filtered_tp['FOLDER_TO_TITLE'])
+    client_folder_activity_mask = from_is_client | to_is_client
+
+    # When the IDs in the selection are dense, a boolean table indexed by (ID - smallest ID) answers
+    # "has any client folder activity" for each latest row by position, without hashing IDs.
+    # Sparse IDs would make that table huge, so they fall back to a hashed isin.
+    candidate_ids = filtered_tp['CAMPAIGNINVITATIONID'].to_numpy().astype(np.int64)
+    client_folder_ids = candidate_ids[client_folder_activity_mask]
+    first_id = int(candidate_ids.min())
+    id_span = int(candidate_ids.max()) - first_id + 1
+    if id_span <= 8 * len(candidate_ids):
+        has_client_folder_history = np.zeros(id_span, dtype=bool)
+        has_client_folder_history[client_folder_ids - first_id] = True
+        latest_ids = latest_activity['CAMPAIGNINVITATIONID'].to_numpy().astype(np.int64)
+        in_client_folder = has_client_folder_history[latest_ids - first_id]
+    else:
+        in_client_folder = latest_activity['CAMPAIGNINVITATIONID'].isin(client_folder_ids)
+    latest_activity = latest_activity.assign(in_client_folder=in_client_folder)
+
+    # Apply labels to the latest activities
+    latest_activity = latest_activity.assign(
+        Row_label=get_row_labels,
+        Column_label=lambda activity: get_time_buckets(activity['ACTIVITY_CREATED_AT'])
+    )
+    breakdown['labels'] = latest_activity[['CAMPAIGNINVITATIONID', 'Row_label', 'Column_label']]
+
+    # --- Pivot Table Calculation (Time Buckets) ---
+    pivot_data = latest_activity.dropna(subset=['Row_label'])
+    if pivot_data.empty:
+        return breakdown
+
+    pivot_table_time = count_candidates(pivot_data, ['Row_label'], 'Column_label')
+
+    pivot_table_time = pivot_table_time.reindex(index=ROW_CATEGORIES, columns=TIME_CATEGORIES, fill_value=0)
+
+    pivot_table_time['Grand Total'] = pivot_table_time.sum(axis=1)
+    pivot_table_time.loc['Grand Total'] = pivot_table_time.sum(axis=0)
+    breakdown['pivot_time'] = pivot_table_time
+
+    # --- Pivot Table Calculation (Daily) ---
+    # Filter for the last 8 days based on the selected end_date from the main filter:
+    # calendar days from each activity's date back from end_date, computed once without per-row date objects
+    days_before_end = (pd.Timestamp(end_date) - pivot_data['ACTIVITY_CREATED_AT'].dt.normalize()).dt.days
+    in_daily_window = days_before_end.between(0, 7)
+    daily_pivot_data = pivot_data[in_daily_window]
+    if daily_pivot_data.empty:
+        return breakdown
+
+    # Define columns for the last 8 days ending on the selected end_date to ensure they are all present and sorted
+    daily_cols = [(end_date - timedelta(days=i)).strftime('%b_%d') for i in range(7, -1, -1)]
+
+    # Each row's day column is looked up from its offset instead of formatting every timestamp with strftime
+    daily_pivot_data = daily_pivot_data.assign(
+        activity_date_str=pd.Categorical.from_codes(7 - days_before_end[in_daily_window].to_numpy(), daily_cols)
+    )
+
+    # One pass collapses the window to candidate counts per label, day, reject reason and CEFR category;
+    # the daily, CEFR and rejection tables below are all sums over these few rows.
+    # Plain object groupers keep the reason rows in alphabetical order rather than category order
+    count_keys = ['Row_label', 'activity_date_str', 'FAILED_REASON_filled']
+    daily_pivot_data = daily_pivot_data.assign(
+        FAILED_REASON_filled=daily_pivot_data['FAILED_REASON'].astype(object).fillna('No Reason Provided')
+    )
+    if has_cefr:
+        daily_pivot_data = daily_pivot_data.assign(CEFR_Category=categorize_cefr(daily_pivot_data['CEFR']))
+        count_keys.append('CEFR_Category')
+    daily_counts = daily_pivot_data.groupby(count_keys, observed=True, sort=False).size()
+    row_labels = daily_counts.index.get_level_values('Row_label')
+
+    daily_pivot_table = sum_counts(daily_counts, ['Row_label'], 'activity_date_str')
+    daily_pivot_table = daily_pivot_table.reindex(index=ROW_CATEGORIES, columns=daily_cols, fill_value=0)
+
+    # Add Grand Totals
+    daily_pivot_table['Grand Total'] = daily_pivot_table.sum(axis=1)
+    daily_pivot_table.loc['Grand Total'] = daily_pivot_table.sum(axis=0)
+    breakdown['daily_pivot'] = daily_pivot_table
+
+    # --- CEFR Breakdown Table ---
+    # An empty table means the 'CEFR' column is missing
+    new_endorsement_counts = daily_counts[row_labels == 'New (for endorsement)']
+
+    if not new_endorsement_counts.empty:
+        breakdown['cefr_pivot'] = pd.DataFrame()
+        if has_cefr:
+            cefr_pivot_table = sum_counts(new_endorsement_counts, ['CEFR_Category'], 'activity_date_str')
+
+            cefr_row_order = CEFR_SEQUENCE + ['No CEFR', 'Others']
+            cefr_pivot_table = cefr_pivot_table.reindex(index=cefr_row_order, columns=daily_cols, fill_value=0)
+            cefr_pivot_table['Grand Total'] = cefr_pivot_table.sum(axis=1)
+
+            cefr_pivot_table_to_display = cefr_pivot_table[cefr_pivot_table['Grand Total'] > 0].copy()
+
+            if not cefr_pivot_table_to_display.empty:
+                cefr_pivot_table_to_display.loc['Grand Total'] = cefr_pivot_table_to_display.sum(axis=0)
+            breakdown['cefr_pivot'] = cefr_pivot_table_to_display
+
+    # --- Rejected Waterfall Breakdown Table ---
+    # An empty table means the 'CEFR' column is missing
+    rejected_counts = daily_counts[row_labels == 'Rejected (for waterfall)']
+
+    if not rejected_counts.empty:
+        breakdown['rejection_pivot'] = pd.DataFrame()
+        if has_cefr:
+            rejection_pivot = sum_counts(rejected_counts, ['FAILED_REASON_filled', 'CEFR_Category'], 'activity_date_str')
+
+            # Rename the index levels for better display
+            rejection_pivot.index.set_names(['HM Reject reasons', 'CEFR'], inplace=True)
+
+            rejection_pivot = rejection_pivot.reindex(columns=daily_cols, fill_value=0)
+            rejection_pivot['Grand Total'] = rejection_pivot.sum(axis=1)
+
+            if not rejection_pivot.empty:
+                # Add grand total row for columns
+                rejection_pivot.loc[('Grand Total', ''), :] = rejection_pivot.sum(axis=0)
+            # Adding the total row upcasts the counts to float; cast back so they display as whole numbers
+            breakdown['rejection_pivot'] = rejection_pivot.astype('int64')
+
+    return breakdown
+
+# The CSV bytes are the largest cached objects, so only the last few selections are kept
+@st.cache_data(ttl=3600, max_entries=4)
+def build_download_csv(start_date, end_date, sites, titles):
+    """
+    Serializes the filtered raw data with each candidate's labels, in file row order.
+    - Labels come from the cached compute_breakdown() for the same selection.
+    - Returns the CSV as bytes, ready for st.download_button.
+    """
+    filtered_tp = filter_data(load_data(), start_date, end_date, sites, titles).sort_index()
+    labels_by_id = compute_breakdown(start_date, end_date, sites, titles)['labels'].set_index('CAMPAIGNINVITATIONID')
+    data_for_download = filtered_tp.assign(
+        Row_label=filtered_tp['CAMPAIGNINVITATIONID'].map(labels_by_id['Row_label']),
+        Column_label=filtered_tp['CAMPAIGNINVITATIONID'].map(labels_by_id['Column_label'])
+    )
+    # Written straight to a bytes buffer, skipping the intermediate str copy of the whole CSV
+    csv_buffer = io.BytesIO()
+    data_for_download.to_csv(csv_buffer, index=False, encoding='utf-8')
+    return csv_buffer.getvalue()
+
 # Load the data using the cached function
 tp = load_data()
 
 # Proceed only if data is loaded successfully
 if tp is not None:
 
-    # --- System Folder Definition ---
-    SYSTEM_FOLDERS = [
-        '', 'Inbox', 'Unresponsive', 'Completed', 'Unresponsive Talkscore', 'Passed MQ', 'Failed MQ',
-        'TalkScore Retake', 'Unresponsive Talkscore Retake', 'Failed TalkScore', 'Cold Leads',
-        'Cold Leads Talkscore', 'Cold Leads Talkscore Retake', 'On hold', 'Rejected',
-        'Talent Pool', 'Shortlisted', 'Hired', 'Candidate Databank', 'For Talkscore',
-        'Tier 2 Program', 'Tier 1 Program', 'For Versant', 'For Reengagement'
-    ]
-
     # --- Filters Section ---
     st.header("Filters")
     
@@ -68,7 +428,7 @@ if tp is not None:
 
     # Filter 2: Expander for 'CAMPAIGN_SITE' with Select All
     with st.expander("Select Campaign Site(s)"):
-        unique_sites = sorted(tp['CAMPAIGN_SITE'].dropna().unique())
+        unique_sites = get_campaign_sites()
         select_all_sites = st.checkbox("Select All Sites", value=True, key='sites_select_all')
         default_selection_sites = unique_sites if select_all_sites else []
         selected_sites = st.multiselect(
@@ -83,7 +443,7 @@ if tp is not None:
             st.warning("Please select a Campaign Site to see available titles.")
             selected_titles = []
         else:
-            available_titles = sorted(tp[tp['CAMPAIGN_SITE'].isin(selected_sites)]['CAMPAIGNTITLE'].dropna().unique())
+            available_titles = get_campaign_titles(tuple(sorted(selected_sites)))
             select_all_titles = st.checkbox("Select All Titles", value=True, key='titles_select_all')
             default_selection_titles = available_titles if select_all_titles else []
             selected_titles = st.multiselect(
@@ -92,153 +452,50 @@ if tp is not None:
             )
     st.divider()
 
-    # --- Data Filtering Logic ---
-    start_datetime = datetime.combine(start_date, datetime.min.time())
-    end_datetime = datetime.combine(end_date, datetime.max.time())
-
-    filtered_tp = tp[
-        (tp['INVITATIONDT'] >= start_datetime) &
-        (tp['INVITATIONDT'] <= end_datetime) &
-        (tp['CAMPAIGN_SITE'].isin(selected_sites)) &
-        (tp['CAMPAIGNTITLE'].isin(selected_titles))
-    ].copy()
-
     # --- Data Analysis and Labeling ---
-    if not filtered_tp.empty:
-        latest_activity = filtered_tp.loc[filtered_tp.groupby('CAMPAIGNINVITATIONID')['ACTIVITY_CREATED_AT'].idxmax()].copy()
-
-        # A folder is a 'Client Folder' if it's not null/NaN and not in the SYSTEM_FOLDERS list.
-        from_is_client = (filtered_tp['FOLDER_FROM_TITLE'].notna()) & (~filtered_tp['FOLDER_FROM_TITLE'].isin(SYSTEM_FOLDERS))
-        to_is_client = (filtered_tp['FOLDER_TO_TITLE'].notna()) & (~filtered_tp['FOLDER_TO_TITLE'].isin(SYSTEM_FOLDERS))
-        client_folder_activity_mask = from_is_client | to_is_client
-
-        ids_with_client_folder_history = filtered_tp.loc[client_folder_activity_mask, 'CAMPAIGNINVITATIONID'].unique()
-        latest_activity['in_client_folder'] = latest_activity['CAMPAIGNINVITATIONID'].isin(ids_with_client_folder_history)
-
-        # Define categorization functions
-        def get_row_label(row):
-            if row['FOLDER_TO_TITLE'] == 'Candidate Databank':
-                return 'Candidate Databank (in Cooling Period)'
-            elif (row['FOLDER_TO_TITLE'] == 'Talent Pool' and not row['in_client_folder'] and pd.isnull(row['FAILED_REASON'])):
-                return 'New (for endorsement)'
-            elif (row['in_client_folder'] and row['FOLDER_TO_TITLE'] != 'Candidate Databank' and pd.notnull(row['FAILED_REASON'])):
-                return 'Rejected (for waterfall)'
-            return None # Return None if no category matches
-
-        def get_time_bucket(activity_date):
-            if pd.isnull(activity_date): return None
-            days = (datetime.now() - activity_date).days
-            if days < 1: return "<24hrs"
-            if 1 <= days <= 3: return "1-3 days"
-            if 4 <= days <= 7: return "4-7 days"
-            if 8 <= days <= 15: return "8-15 days"
-            if 16 <= days <= 30: return "16-30 days"
-            return "31+ days"
-
-        # Apply labels to the latest activities
-        latest_activity['Row_label'] = latest_activity.apply(get_row_label, axis=1)
-        latest_activity['Column_label'] = latest_activity['ACTIVITY_CREATED_AT'].apply(get_time_bucket)
-
-        # Prepare data for download by merging labels into the filtered raw data
-        label_mapping = latest_activity[['CAMPAIGNINVITATIONID', 'Row_label', 'Column_label']]
-        data_for_download = pd.merge(
-            filtered_tp, label_mapping, on='CAMPAIGNINVITATIONID', how='left'
-        )
-        
+    breakdown = compute_breakdown(start_date, end_date, tuple(selected_sites), tuple(selected_titles))
+
+    if breakdown is not None:
         # --- Download Button for Labeled Data ---
-        st.download_button(
-           label="Download Filtered Data as CSV (with labels)",
-           data=data_for_download.to_csv(index=False).encode('utf-8'),
-           file_name='filtered_talentpool_data_with_labels.csv',
-           mime='text/csv',
-        )
+        # The CSV is only built once asked for, and only for the selection it was asked for
+        download_selection = (start_date, end_date, tuple(selected_sites), tuple(selected_titles))
+        download_ready = st.session_state.get('download_selection') == download_selection
+        if not download_ready and st.button("Prepare Filtered Data for Download"):
+            st.session_state['download_selection'] = download_selection
+            download_ready = True
+        if download_ready:
+            st.download_button(
+               label="Download Filtered Data as CSV (with labels)",
+               data=build_download_csv(*download_selection),
+               file_name='filtered_talentpool_data_with_labels.csv',
+               mime='text/csv',
+            )
         st.divider()
 
-        # --- Pivot Table Calculation (Time Buckets) ---
-        pivot_data = latest_activity.dropna(subset=['Row_label'])
+        # --- Pivot Table (Time Buckets) ---
+        pivot_table_time = breakdown['pivot_time']
         
-        if not pivot_data.empty:
+        if pivot_table_time is not None:
             st.header("TALENTPOOL BREAKDOWN")
-            pivot_table_time = pd.crosstab(
-                index=pivot_data['Row_label'],
-                columns=pivot_data['Column_label'],
-                values=pivot_data['CAMPAIGNINVITATIONID'],
-                aggfunc='nunique'
-            ).fillna(0)
-
-            time_categories = ["<24hrs", "1-3 days", "4-7 days", "8-15 days", "16-30 days", "31+ days"]
-            row_categories = ['New (for endorsement)', 'Rejected (for waterfall)', 'Candidate Databank (in Cooling Period)']
-            pivot_table_time = pivot_table_time.reindex(index=row_categories, columns=time_categories, fill_value=0)
-
-            pivot_table_time['Grand Total'] = pivot_table_time.sum(axis=1)
-            pivot_table_time.loc['Grand Total'] = pivot_table_time.sum(axis=0)
-            
-            st.dataframe(pivot_table_time.style.format("{:.0f}"))
+            st.dataframe(pivot_table_time)
             st.divider()
 
-            # --- Pivot Table Calculation (Daily) ---
+            # --- Pivot Table (Daily) ---
             st.header("TALENTPOOL BREAKDOWN (Daily)")
+            daily_pivot_table = breakdown['daily_pivot']
             
-            # Filter for the last 8 days based on the selected end_date from the main filter
-            last_8_days_start_date = end_date - timedelta(days=7)
-            daily_pivot_data = pivot_data[
-                (pivot_data['ACTIVITY_CREATED_AT'].dt.date >= last_8_days_start_date) & 
-                (pivot_data['ACTIVITY_CREATED_AT'].dt.date <= end_date)
-            ].copy()
-            
-            if not daily_pivot_data.empty:
-                daily_pivot_data['activity_date_str'] = daily_pivot_data['ACTIVITY_CREATED_AT'].dt.strftime('%b_%d')
-                
-                daily_pivot_table = pd.crosstab(
-                    index=daily_pivot_data['Row_label'],
-                    columns=daily_pivot_data['activity_date_str'],
-                    values=daily_pivot_data['CAMPAIGNINVITATIONID'],
-                    aggfunc='nunique'
-                ).fillna(0)
-
-                # Define columns for the last 8 days ending on the selected end_date to ensure they are all present and sorted
-                daily_cols = [(end_date - timedelta(days=i)).strftime('%b_%d') for i in range(7, -1, -1)]
-                daily_pivot_table = daily_pivot_table.reindex(index=row_categories, columns=daily_cols, fill_value=0)
-
-                # Add Grand Totals
-                daily_pivot_table['Grand Total'] = daily_pivot_table.sum(axis=1)
-                daily_pivot_table.loc['Grand Total'] = daily_pivot_table.sum(axis=0)
-
-                st.dataframe(daily_pivot_table.style.format("{:.0f}"))
+            if daily_pivot_table is not None:
+                st.dataframe(daily_pivot_table)
                 st.divider()
 
                 # --- CEFR Breakdown Table ---
                 st.header("New (for endorsement) : CEFR breakdown")
-                
-                new_endorsement_data_daily = daily_pivot_data[daily_pivot_data['Row_label'] == 'New (for endorsement)'].copy()
-
-                if not new_endorsement_data_daily.empty:
-                    if 'CEFR' in new_endorsement_data_daily.columns:
-                        cefr_sequence = ["C1", "C2", "B1", "B1+", "B2", "B2+", "A0", "A2", "A2+"]
-                        
-                        def categorize_cefr(cefr_value):
-                            if cefr_value in cefr_sequence: return cefr_value
-                            elif pd.isna(cefr_value) or cefr_value == '': return 'No CEFR'
-                            else: return 'Others'
-
-                        new_endorsement_data_daily['CEFR_Category'] = new_endorsement_data_daily['CEFR'].apply(categorize_cefr)
-
-                        cefr_pivot_table = pd.crosstab(
-                            index=new_endorsement_data_daily['CEFR_Category'],
-                            columns=new_endorsement_data_daily['activity_date_str'],
-                            values=new_endorsement_data_daily['CAMPAIGNINVITATIONID'],
-                            aggfunc='nunique'
-                        ).fillna(0)
-                        
-                        cefr_row_order = cefr_sequence + ['No CEFR', 'Others']
-                        cefr_pivot_table = cefr_pivot_table.reindex(index=cefr_row_order, columns=daily_cols, fill_value=0)
-                        cefr_pivot_table['Grand Total'] = cefr_pivot_table.sum(axis=1)
-
-                        cefr_pivot_table_to_display = cefr_pivot_table[cefr_pivot_table['Grand Total'] > 0].copy()
-                        
-                        if not cefr_pivot_table_to_display.empty:
-                            cefr_pivot_table_to_display.loc['Grand Total'] = cefr_pivot_table_to_display.sum(axis=0)
-                            st.dataframe(cefr_pivot_table_to_display.style.format("{:.0f}"))
+                cefr_pivot_table = breakdown['cefr_pivot']
+
+                if cefr_pivot_table is not None:
+                    if 'CEFR' in tp.columns:
+                        if not cefr_pivot_table.empty:
+                            st.dataframe(cefr_pivot_table)
                         else: st.info(f"No candidates with CEFR data found for this period in the 'New (for endorsement)' category.")
                     else: st.warning("The 'CEFR' column was not found in the dataset.")
                 else: st.warning(f"No 'New (for endorsement)' candidates found in the 8-day period ending {end_date.strftime('%b %d, %Y')}.")
@@ -247,42 +504,17 @@ if tp is not None:
 
                 # --- Rejected Waterfall Breakdown Table ---
                 st.header("Rejected (for waterfall): HM Reject reasons with CEFR breakdown")
-                
-                rejected_data_daily = daily_pivot_data[daily_pivot_data['Row_label'] == 'Rejected (for waterfall)'].copy()
-
-                if not rejected_data_daily.empty:
-                    if 'CEFR' in rejected_data_daily.columns and 'FAILED_REASON' in rejected_data_daily.columns:
-                        
-                        def categorize_cefr_reject(cefr_value):
-                            if cefr_value in cefr_sequence: return cefr_value
-                            elif pd.isna(cefr_value) or cefr_value == '': return 'No CEFR'
-                            else: return 'Others'
-                        
-                        rejected_data_daily['CEFR_Category'] = rejected_data_daily['CEFR'].apply(categorize_cefr_reject)
-                        rejected_data_daily['FAILED_REASON_filled'] = rejected_data_daily['FAILED_REASON'].fillna('No Reason Provided')
-
-                        rejection_pivot = pd.crosstab(
-                            index=[rejected_data_daily['FAILED_REASON_filled'], rejected_data_daily['CEFR_Category']],
-                            columns=rejected_data_daily['activity_date_str'],
-                            values=rejected_data_daily['CAMPAIGNINVITATIONID'],
-                            aggfunc='nunique'
-                        ).fillna(0)
-                        
-                        # Rename the index levels for better display
-                        rejection_pivot.index.set_names(['HM Reject reasons', 'CEFR'], inplace=True)
-
-                        rejection_pivot = rejection_pivot.reindex(columns=daily_cols, fill_value=0)
-                        rejection_pivot['Grand Total'] = rejection_pivot.sum(axis=1)
+                rejection_pivot = breakdown['rejection_pivot']
 
+                if rejection_pivot is not None:
+                    if 'CEFR' in tp.columns:
                         if not rejection_pivot.empty:
-                            # Add grand total row for columns
-                            rejection_pivot.loc[('Grand Total', ''), :] = rejection_pivot.sum(axis=0)
-                            st.dataframe(rejection_pivot.style.format("{:.0f}"))
+                            st.dataframe(rejection_pivot)
                         else:
                             st.info("No rejection data to display for the selected period.")
 
                     else:
-                        st.warning("The 'CEFR' and/or 'FAILED_REASON' columns were not found.")
+                        st.warning("The 'CEFR' column was not found in the dataset.")
                 else:
                     st.warning(f"No 'Rejected (for waterfall)' candidates found in the 8-day period ending {end_date.strftime('%b %d, %Y')}.")
 